@@ -3,22 +3,29 @@ FastAPI service for voice anomaly detection.
 Provides endpoints for embedding extraction and comparison.
 """
 import os
+import anyio.to_thread
+import asyncio
+import base64
+import hashlib
 import logging
 import numpy as np
-from typing import List, Optional
+from typing import Annotated, List, Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, HttpUrl
 from dotenv import load_dotenv
 
-from utils.audio import load_audio_from_url, get_embedding, compute_snr, load_model
-from utils.scoring import (
-    cosine_similarity,
-    similarity_to_anomaly,
-    apply_noise_normalization,
-    apply_time_compensation,
+from utils.audio import (
+    load_audio_from_url,
+    get_embedding,
+    get_embeddings_batch,
+    compute_snr,
+    load_model,
 )
+from utils.cache import LRUEmbeddingCache
+from utils.scoring import cosine_similarity, compute_anomaly_score, quantize_embedding
 
 # Load environment variables
 load_dotenv()
@@ -34,6 +41,9 @@ logger = logging.getLogger(__name__)
 # Global model loading state
 _model_loading_error = None
 
+# Embedding cache (exact-match LRU + semantic layer over recent embeddings)
+_embedding_cache = LRUEmbeddingCache(capacity=1024, ttl=3600)
+
 # Lifespan event handlers
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -42,6 +52,8 @@ async def lifespan(app: FastAPI):
     # Startup
     try:
         logger.info("Starting voice anomaly detection service...")
+        # Size the thread pool used for CPU-bound inference/SNR offloading
+        anyio.to_thread.current_default_thread_limiter().total_tokens = os.cpu_count() or 4
         load_model()
         logger.info("Voice anomaly detection service started successfully")
         _model_loading_error = None
@@ -62,7 +74,8 @@ app = FastAPI(
     title="RetroCare Voice Anomaly Detection",
     description="Microservice for voice embedding extraction and anomaly detection",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson is 2-5x faster than stdlib json
 )
 
 # CORS configuration
@@ -77,22 +90,47 @@ app.add_middleware(
 
 
 # Pydantic models
+
+# Validates incoming embeddings straight into contiguous float32 arrays,
+# skipping the intermediate List[float] materialization
+NDArrayF32 = Annotated[np.ndarray, BeforeValidator(lambda v: np.asarray(v, dtype=np.float32))]
+
+
 class EmbedRequest(BaseModel):
     audio_url: HttpUrl
     sample_rate: int = 16000
+    quantize: bool = False  # include int8-quantized embedding in the response
 
 
 class EmbedResponse(BaseModel):
-    embedding: List[float]
+    embedding: List[float]  # deprecated: prefer embedding_b64 (~8x smaller payload)
+    embedding_b64: str  # base64-encoded float16 bytes
+    embedding_q8: Optional[str] = None  # base64-encoded int8 vector (~4x smaller)
+    scale: Optional[float] = None  # quantization scale: original ~= int8 / scale
     snr: float
     sample_rate: int
 
 
+class EmbedBatchRequest(BaseModel):
+    urls: List[HttpUrl]
+    sample_rate: int = 16000
+
+
+class EmbedBatchResponse(BaseModel):
+    embeddings: List[List[float]]
+    snrs: List[float]
+    sample_rate: int
+
+
 class CompareRequest(BaseModel):
-    baseline: List[float]
-    current: List[float]
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    baseline: Optional[NDArrayF32] = None
+    current: Optional[NDArrayF32] = None
+    baseline_b64: Optional[str] = None  # base64 float16 bytes, preferred over the list form
+    current_b64: Optional[str] = None
     snr: float
-    hour: Optional[int] = None
+    hour: Optional[int] = Field(None, ge=0, le=23)
 
 
 class CompareResponse(BaseModel):
@@ -102,6 +140,48 @@ class CompareResponse(BaseModel):
     snr: float
 
 
+class CompareBatchRequest(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    baseline: NDArrayF32
+    currents: NDArrayF32  # shape (N, embedding_dim)
+    snr: float
+    hour: Optional[int] = Field(None, ge=0, le=23)
+
+
+class CompareBatchResponse(BaseModel):
+    scores: List[float]  # anomaly scores 0.0-1.0, one per current
+    raw_similarities: List[float]  # cosine similarities
+    snr: float
+
+
+def _build_embed_response(embedding: np.ndarray, snr: float, sample_rate: int, quantize: bool) -> EmbedResponse:
+    """Build an EmbedResponse, optionally with the int8-quantized payload."""
+    embedding_q8 = None
+    scale = None
+    if quantize:
+        quantized, scale = quantize_embedding(embedding)
+        embedding_q8 = base64.b64encode(quantized.tobytes()).decode()
+
+    return EmbedResponse(
+        embedding=embedding.tolist(),
+        embedding_b64=base64.b64encode(embedding.astype(np.float16).tobytes()).decode(),
+        embedding_q8=embedding_q8,
+        scale=scale,
+        snr=snr,
+        sample_rate=sample_rate
+    )
+
+
+def _embedding_from_request(values: Optional[np.ndarray], b64: Optional[str], name: str) -> np.ndarray:
+    """Decode an embedding from either its base64 float16 or validated array form."""
+    if b64 is not None:
+        return np.frombuffer(base64.b64decode(b64), dtype=np.float16).astype(np.float32)
+    if values is not None:
+        return values
+    raise ValueError(f"Either {name} or {name}_b64 must be provided")
+
+
 # API Endpoints
 @app.get("/health")
 async def health_check():
@@ -116,6 +196,12 @@ async def health_check():
     }
 
 
+@app.get("/stats")
+async def cache_stats():
+    """Embedding cache statistics (hit rate, size)."""
+    return _embedding_cache.stats()
+
+
 @app.post("/embed", response_model=EmbedResponse)
 async def extract_embedding(request: EmbedRequest):
     """
@@ -132,32 +218,97 @@ async def extract_embedding(request: EmbedRequest):
     
     try:
         logger.info(f"Extracting embedding from: {request.audio_url}")
-        
+
+        # Exact-match cache lookup keyed on the audio URL and requested
+        # sample rate (the same URL at a different rate is a different result)
+        cache_key = hashlib.sha256(f"{request.audio_url}:{request.sample_rate}".encode()).hexdigest()
+        cached = await _embedding_cache.get(cache_key)
+        if cached is not None:
+            embedding, snr, sample_rate = cached
+            logger.info(f"Cache hit for {request.audio_url}, skipping download and inference")
+            return _build_embed_response(embedding, snr, sample_rate, request.quantize)
+
         # Download and load audio
         waveform, sample_rate = await load_audio_from_url(
             str(request.audio_url),
             target_sr=request.sample_rate
         )
-        
-        # Extract embedding
-        embedding = get_embedding(waveform, sample_rate)
-        
-        # Compute SNR
-        snr = compute_snr(waveform, sample_rate)
-        
+
+        # Extract embedding and SNR in worker threads - both are CPU-heavy
+        # (hundreds of ms) and would otherwise block the event loop,
+        # starving health checks and concurrent requests
+        embedding = await anyio.to_thread.run_sync(get_embedding, waveform, sample_rate)
+        snr = await anyio.to_thread.run_sync(compute_snr, waveform, sample_rate)
+
+        # Semantic layer: if a near-identical embedding was computed recently
+        # (same recording under a different URL), reuse the cached entry so
+        # downstream anomaly scores stay stable; only entries computed at
+        # the requested sample rate are considered
+        similar = await _embedding_cache.find_similar(embedding, sample_rate=sample_rate)
+        if similar is not None:
+            embedding, snr, sample_rate = similar
+
+        await _embedding_cache.put(cache_key, embedding, snr, sample_rate)
+
         logger.info(f"Embedding extracted: shape={embedding.shape}, SNR={snr:.2f}dB")
-        
-        return EmbedResponse(
-            embedding=embedding.tolist(),
-            snr=snr,
-            sample_rate=sample_rate
-        )
+
+        return _build_embed_response(embedding, snr, sample_rate, request.quantize)
         
     except Exception as e:
         logger.error(f"Error extracting embedding: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to extract embedding: {str(e)}")
 
 
+@app.post("/embed_batch", response_model=EmbedBatchResponse)
+async def extract_embeddings_batch(request: EmbedBatchRequest):
+    """
+    Extract voice embeddings for multiple audio URLs.
+
+    Downloads all files concurrently (bounded by a semaphore) and runs
+    ECAPA-TDNN on batched tensors instead of one forward pass per file.
+    """
+    from utils.audio import _model_loaded
+
+    if not _model_loaded:
+        error_msg = f"Model not loaded. Error: {_model_loading_error}" if _model_loading_error else "Model not loaded"
+        logger.error(error_msg)
+        raise HTTPException(status_code=503, detail=error_msg)
+
+    try:
+        logger.info(f"Extracting embeddings for {len(request.urls)} URLs")
+
+        # Download concurrently, bounded to avoid saturating the network
+        semaphore = asyncio.Semaphore(16)
+
+        async def download(url: HttpUrl):
+            async with semaphore:
+                return await load_audio_from_url(str(url), target_sr=request.sample_rate)
+
+        results = await asyncio.gather(*[download(url) for url in request.urls])
+        waveforms = [waveform for waveform, _ in results]
+
+        # Batched inference over length-sorted buckets, off the event loop
+        embeddings = await anyio.to_thread.run_sync(
+            get_embeddings_batch, waveforms, request.sample_rate
+        )
+        snrs = [
+            await anyio.to_thread.run_sync(compute_snr, waveform, request.sample_rate)
+            for waveform in waveforms
+        ]
+
+        logger.info(f"Batch embedding complete: {len(embeddings)} embeddings")
+
+        return EmbedBatchResponse(
+            embeddings=[embedding.tolist() for embedding in embeddings],
+            snrs=snrs,
+            sample_rate=request.sample_rate
+        )
+
+    except Exception as e:
+        logger.error(f"Error extracting batch embeddings: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to extract batch embeddings: {str(e)}")
+
+
 @app.post("/compare", response_model=CompareResponse)
 async def compare_embeddings(request: CompareRequest):
     """
@@ -169,9 +320,9 @@ async def compare_embeddings(request: CompareRequest):
     try:
         logger.info("Comparing embeddings")
         
-        # Convert to numpy arrays
-        baseline = np.array(request.baseline)
-        current = np.array(request.current)
+        # Already float32 ndarrays courtesy of the field validators
+        baseline = _embedding_from_request(request.baseline, request.baseline_b64, "baseline")
+        current = _embedding_from_request(request.current, request.current_b64, "current")
         
         # Check dimensions
         if baseline.shape != current.shape:
@@ -180,18 +331,10 @@ async def compare_embeddings(request: CompareRequest):
         # Compute cosine similarity
         similarity = cosine_similarity(baseline, current)
         logger.debug(f"Raw similarity: {similarity:.4f}")
-        
-        # Convert to anomaly score
-        anomaly_score = similarity_to_anomaly(similarity)
-        logger.debug(f"Anomaly score (raw): {anomaly_score:.4f}")
-        
-        # Apply noise normalization
-        normalized_score = apply_noise_normalization(anomaly_score, request.snr)
-        
-        # Apply time-of-day compensation if hour provided
-        if request.hour is not None:
-            normalized_score = apply_time_compensation(normalized_score, request.hour)
-        
+
+        # Fused anomaly score with noise and time-of-day compensation
+        normalized_score = compute_anomaly_score(similarity, request.snr, request.hour)
+
         logger.info(f"Comparison complete: similarity={similarity:.4f}, anomaly={normalized_score:.4f}")
         
         return CompareResponse(
@@ -206,17 +349,65 @@ async def compare_embeddings(request: CompareRequest):
         raise HTTPException(status_code=500, detail=f"Failed to compare embeddings: {str(e)}")
 
 
+@app.post("/compare_batch", response_model=CompareBatchResponse)
+async def compare_embeddings_batch(request: CompareBatchRequest):
+    """
+    Compare one baseline embedding against many current embeddings.
+
+    Computes all cosine similarities as a single matrix-vector product and
+    applies the fused anomaly scoring elementwise, instead of paying
+    per-pair request and dispatch overhead.
+    """
+    try:
+        logger.info(f"Comparing baseline against {len(request.currents)} embeddings")
+
+        # Already float32 ndarrays courtesy of the field validators
+        baseline = request.baseline
+        currents = request.currents
+
+        # Check dimensions
+        if currents.ndim != 2 or currents.shape[1] != baseline.shape[0]:
+            raise ValueError(
+                f"Embedding dimensions don't match: baseline {baseline.shape} vs currents {currents.shape}"
+            )
+
+        # One BLAS matrix-vector product; embeddings are unit-normalized
+        # so each row is directly a cosine similarity
+        similarities = np.clip(currents @ baseline, -1.0, 1.0)
+
+        # Fused anomaly scoring over the whole array
+        scores = compute_anomaly_score(similarities, request.snr, request.hour)
+
+        logger.info(f"Batch comparison complete: {len(scores)} scores")
+
+        return CompareBatchResponse(
+            scores=scores.tolist(),
+            raw_similarities=similarities.tolist(),
+            snr=request.snr
+        )
+
+    except Exception as e:
+        logger.error(f"Error comparing embeddings batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compare embeddings batch: {str(e)}")
+
+
 if __name__ == "__main__":
     import uvicorn
     
     port = int(os.getenv("PORT", 8000))
     # Don't use reload in production - it can cause issues
     reload = os.getenv("ENVIRONMENT", "production") == "development"
+    # uvloop + httptools (bundled with uvicorn[standard]) are markedly
+    # faster than the default asyncio loop + h11 for JSON-heavy endpoints.
+    # Keep WORKERS=1 unless memory allows one model copy per worker.
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=port,
+        loop="uvloop",
+        http="httptools",
         reload=reload,
+        workers=int(os.getenv("WORKERS", 1)),
         log_level="info"
     )
 
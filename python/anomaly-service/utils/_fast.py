@@ -0,0 +1,62 @@
+"""
+Numba-compiled hot loops for scoring and SNR estimation.
+Falls back to plain Python/NumPy if numba is not installed.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op decorator stand-in when numba is unavailable."""
+        def wrap(func):
+            return func
+        return wrap
+
+
+@njit(cache=True, fastmath=True)
+def cosine_sim_f32(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Dot product of two float32 vectors.
+
+    For 192-dim embeddings the NumPy call is dominated by dispatch
+    overhead; the compiled loop autovectorizes and skips all of it.
+    """
+    s = 0.0
+    for i in range(a.size):
+        s += a[i] * b[i]
+    return s
+
+
+@njit(cache=True, fastmath=True)
+def noise_mean_below(power: np.ndarray, threshold: float) -> float:
+    """
+    Mean of power values at or below threshold, in a single pass.
+
+    Replaces the mask + masked-sum combination with one loop that keeps
+    a running sum and count - no boolean or gathered temporaries.
+    """
+    total = 0.0
+    count = 0
+    for i in range(power.size):
+        if power[i] <= threshold:
+            total += power[i]
+            count += 1
+    if count == 0:
+        return 0.0
+    return total / count
+
+
+# Warm the JIT at import time so the first request doesn't pay compile cost
+if NUMBA_AVAILABLE:
+    _dummy = np.zeros(192, dtype=np.float32)
+    cosine_sim_f32(_dummy, _dummy)
+    noise_mean_below(_dummy, 0.0)
+    logger.debug("Numba hot loops compiled")
@@ -0,0 +1,149 @@
+"""
+Caching utilities for embedding extraction.
+Avoids re-downloading and re-running ECAPA-TDNN for audio we have already seen.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LRUEmbeddingCache:
+    """
+    Two-layer cache for (embedding, snr) results.
+
+    Layer 1: exact-match LRU keyed on a hash of the audio URL, with TTL
+    expiry. A hit skips the download and ECAPA inference entirely.
+
+    Layer 2: semantic matching over recently computed embeddings. The same
+    recording is often re-uploaded under a different URL (new signed URL,
+    re-encode); if a freshly computed embedding is near-identical to a cached
+    one (cosine > threshold), the cached entry is reused so downstream
+    anomaly scores stay stable.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        ttl: float = 3600.0,
+        semantic_threshold: float = 0.995,
+        semantic_size: int = 256,
+    ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.semantic_size = semantic_size
+
+        # key -> (embedding, snr, sample_rate, expires_at)
+        self._store: "OrderedDict[str, Tuple[np.ndarray, float, int, float]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+        # Semantic layer: rows of recently computed embeddings (float32),
+        # with parallel (snr, sample_rate) metadata. Embeddings are
+        # unit-normalized so M @ new_emb gives cosine similarities directly.
+        self._sem_matrix: Optional[np.ndarray] = None
+        self._sem_meta: list = []
+
+        # Stats
+        self._hits = 0
+        self._semantic_hits = 0
+        self._misses = 0
+
+    async def get(self, key: str) -> Optional[Tuple[np.ndarray, float, int]]:
+        """
+        Look up an exact-match entry by key.
+
+        Returns:
+            Tuple of (embedding, snr, sample_rate) on hit, None on miss/expiry.
+        """
+        async with self._lock:
+            entry = self._store.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            embedding, snr, sample_rate, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self._store[key]
+                self._misses += 1
+                return None
+
+            # Mark as most recently used
+            self._store.move_to_end(key)
+            self._hits += 1
+            return embedding, snr, sample_rate
+
+    async def put(self, key: str, embedding: np.ndarray, snr: float, sample_rate: int):
+        """Store a computed result under key and index it for semantic lookup."""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        async with self._lock:
+            self._store[key] = (embedding, snr, sample_rate, time.monotonic() + self.ttl)
+            self._store.move_to_end(key)
+
+            # Evict least recently used entries beyond capacity
+            while len(self._store) > self.capacity:
+                self._store.popitem(last=False)
+
+            # Append to the semantic index (bounded ring of recent embeddings)
+            if self._sem_matrix is None:
+                self._sem_matrix = embedding[np.newaxis, :]
+            else:
+                self._sem_matrix = np.vstack([self._sem_matrix, embedding])
+            self._sem_meta.append((embedding, snr, sample_rate))
+            if len(self._sem_meta) > self.semantic_size:
+                self._sem_matrix = self._sem_matrix[1:]
+                self._sem_meta.pop(0)
+
+    async def find_similar(
+        self,
+        embedding: np.ndarray,
+        sample_rate: Optional[int] = None,
+    ) -> Optional[Tuple[np.ndarray, float, int]]:
+        """
+        Semantic lookup: find a cached embedding nearly identical to the given one.
+
+        Args:
+            embedding: Freshly computed embedding to match against
+            sample_rate: If given, only entries computed at this rate match
+
+        Returns:
+            Cached (embedding, snr, sample_rate) if cosine similarity exceeds
+            the threshold, None otherwise.
+        """
+        async with self._lock:
+            if self._sem_matrix is None:
+                return None
+
+            # One matrix-vector product over recent embeddings
+            sims = self._sem_matrix @ np.asarray(embedding, dtype=np.float32)
+
+            # Entries from a different sample rate are not interchangeable
+            if sample_rate is not None:
+                for i, (_, _, entry_sr) in enumerate(self._sem_meta):
+                    if entry_sr != sample_rate:
+                        sims[i] = -1.0
+
+            best = int(np.argmax(sims))
+            if float(sims[best]) > self.semantic_threshold:
+                self._semantic_hits += 1
+                logger.debug(f"Semantic cache hit: similarity={float(sims[best]):.4f}")
+                return self._sem_meta[best]
+
+            return None
+
+    def stats(self) -> dict:
+        """Return cache hit/miss counters and current size."""
+        total = self._hits + self._semantic_hits + self._misses
+        return {
+            "size": len(self._store),
+            "capacity": self.capacity,
+            "hits": self._hits,
+            "semantic_hits": self._semantic_hits,
+            "misses": self._misses,
+            "hit_rate": (self._hits + self._semantic_hits) / total if total > 0 else 0.0,
+        }
@@ -3,57 +3,156 @@ Similarity and anomaly scoring utilities.
 Converts embeddings to anomaly scores with optional normalization.
 """
 import numpy as np
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import logging
 
+from utils._fast import cosine_sim_f32
+
 logger = logging.getLogger(__name__)
 
+# Per-hour compensation factors (LUT indexed by hour of day).
+# Morning 6-9 AM: voices may be lower/deeper -> 8% reduction.
+# Evening 6-9 PM: voices may be tired -> 6% reduction.
+_HOUR_FACTOR = np.ones(24, dtype=np.float32)
+_HOUR_FACTOR[6:10] = 0.92
+_HOUR_FACTOR[18:22] = 0.94
+
+
+def compute_anomaly_score(similarity, snr, hour: Optional[int] = None):
+    """
+    Convert similarity to a noise- and time-compensated anomaly score.
+
+    Fuses similarity_to_anomaly, apply_noise_normalization, and
+    apply_time_compensation into one branchless expression so it can run
+    elementwise over arrays of similarities (batch compare) as well as
+    scalars, without per-element Python call frames.
+
+    Args:
+        similarity: Cosine similarity, scalar or array
+        snr: Signal-to-noise ratio in dB, scalar or array matching similarity
+        hour: Hour of day (0-23), None to skip time compensation
+
+    Returns:
+        Anomaly score(s) from 0.0 (normal) to 1.0 (very different);
+        float for scalar input, ndarray for array input
+    """
+    anomaly = np.clip(1.0 - np.asarray(similarity, dtype=np.float32), 0.0, 1.0)
+
+    # Low SNR reduces the score by up to 25% (at SNR=0), linearly to 0% at SNR=15
+    snr_factor = 1.0 - 0.25 * np.maximum(0.0, 15.0 - np.asarray(snr, dtype=np.float32)) / 15.0
+
+    # Hours outside 0-23 get no compensation, matching the old window checks
+    hour_factor = _HOUR_FACTOR[hour] if hour is not None and 0 <= hour < 24 else 1.0
+    factor = snr_factor * hour_factor
+    scores = anomaly * factor
+
+    return float(scores) if scores.ndim == 0 else scores
 
-def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
+
+def cosine_similarity(
+    embedding1: np.ndarray,
+    embedding2: np.ndarray,
+    assume_normalized: bool = True,
+) -> float:
     """
     Compute cosine similarity between two embeddings.
-    
+
+    Expects numpy arrays (float32 preferred) - callers should convert
+    once with np.asarray rather than passing Python lists.
+
     Args:
         embedding1: First embedding vector
         embedding2: Second embedding vector
-    
+        assume_normalized: If True (default), skip the norm computation.
+            get_embedding already returns unit-length vectors, so the
+            similarity collapses to a single dot product.
+
     Returns:
         Cosine similarity value between -1 and 1 (typically 0 to 1 for normalized embeddings)
     """
     try:
-        # Ensure embeddings are numpy arrays
-        emb1 = np.array(embedding1)
-        emb2 = np.array(embedding2)
-        
         # Check dimensions match
-        if emb1.shape != emb2.shape:
-            raise ValueError(f"Embedding shapes don't match: {emb1.shape} vs {emb2.shape}")
-        
-        # Compute dot product
-        dot_product = np.dot(emb1, emb2)
-        
-        # Compute norms
-        norm1 = np.linalg.norm(emb1)
-        norm2 = np.linalg.norm(emb2)
-        
-        # Avoid division by zero
-        if norm1 == 0 or norm2 == 0:
-            logger.warning("Zero norm embedding detected")
-            return 0.0
-        
-        # Cosine similarity
-        similarity = dot_product / (norm1 * norm2)
-        
+        if embedding1.shape != embedding2.shape:
+            raise ValueError(f"Embedding shapes don't match: {embedding1.shape} vs {embedding2.shape}")
+
+        # Single fused dot - compiled loop for the common float32 case,
+        # BLAS otherwise; no copies, no intermediate arrays
+        if embedding1.dtype == np.float32 and embedding2.dtype == np.float32:
+            similarity = float(cosine_sim_f32(embedding1, embedding2))
+        else:
+            similarity = float(np.dot(embedding1, embedding2))
+
+        if not assume_normalized:
+            norm1 = np.linalg.norm(embedding1)
+            norm2 = np.linalg.norm(embedding2)
+
+            # Avoid division by zero
+            if norm1 == 0 or norm2 == 0:
+                logger.warning("Zero norm embedding detected")
+                return 0.0
+
+            similarity = similarity / float(norm1 * norm2)
+
         # Clamp to [-1, 1] range
-        similarity = max(-1.0, min(1.0, similarity))
-        
-        return float(similarity)
-        
+        return max(-1.0, min(1.0, similarity))
+
     except Exception as e:
         logger.error(f"Error computing cosine similarity: {e}")
         raise
 
 
+def quantize_embedding(embedding: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Quantize an embedding to int8 for compact storage/transport.
+
+    Scales by 127/max(|x|) so the full int8 range is used; ECAPA embeddings
+    are L2-normalized, so uniform quantization is well-behaved and cosine
+    similarities between quantized vectors stay near-identical to float.
+
+    Args:
+        embedding: Embedding vector (float32)
+
+    Returns:
+        Tuple of (int8 vector, scale) where original ~= int8 / scale
+    """
+    peak = float(np.max(np.abs(embedding)))
+    if peak == 0:
+        return np.zeros(embedding.shape, dtype=np.int8), 1.0
+
+    scale = 127.0 / peak
+    quantized = np.round(embedding * scale).astype(np.int8)
+    return quantized, scale
+
+
+def cosine_similarity_q8(
+    q1: np.ndarray,
+    q2: np.ndarray,
+    scale1: float,
+    scale2: float,
+) -> float:
+    """
+    Cosine similarity between two int8-quantized unit embeddings.
+
+    The integer dot product runs on SIMD int paths; dividing by the two
+    quantization scales recovers the float similarity.
+
+    Args:
+        q1: First quantized embedding (int8)
+        q2: Second quantized embedding (int8)
+        scale1: Quantization scale of q1
+        scale2: Quantization scale of q2
+
+    Returns:
+        Cosine similarity value between -1 and 1
+    """
+    if q1.shape != q2.shape:
+        raise ValueError(f"Embedding shapes don't match: {q1.shape} vs {q2.shape}")
+
+    # Upcast to int32 so the 192-element dot cannot overflow
+    similarity = float(np.dot(q1.astype(np.int32), q2.astype(np.int32))) / (scale1 * scale2)
+    return max(-1.0, min(1.0, similarity))
+
+
 def similarity_to_anomaly(similarity: float) -> float:
     """
     Convert cosine similarity to anomaly score.
@@ -86,20 +185,10 @@ def apply_noise_normalization(anomaly_score: float, snr: float) -> float:
     Returns:
         Normalized anomaly score
     """
-    # If SNR is low (< 15 dB), reduce anomaly score
-    # Reduction factor: 15-25% depending on how bad the SNR is
-    if snr < 15.0:
-        # Linear reduction: worse SNR = more reduction
-        # At SNR=0: reduce by 25%
-        # At SNR=15: reduce by 0%
-        reduction_factor = 0.25 * (15.0 - snr) / 15.0
-        reduction = anomaly_score * reduction_factor
-        normalized = anomaly_score - reduction
-        
-        logger.debug(f"SNR normalization: SNR={snr:.2f}dB, reduction={reduction:.4f}, score={anomaly_score:.4f} -> {normalized:.4f}")
-        return max(0.0, normalized)
-    
-    return anomaly_score
+    # If SNR is low (< 15 dB), reduce anomaly score linearly:
+    # at SNR=0 reduce by 25%, at SNR>=15 no reduction
+    snr_factor = 1.0 - 0.25 * max(0.0, 15.0 - snr) / 15.0
+    return max(0.0, anomaly_score * snr_factor)
 
 
 def apply_time_compensation(anomaly_score: float, hour: Optional[int] = None) -> float:
@@ -118,26 +207,11 @@ def apply_time_compensation(anomaly_score: float, hour: Optional[int] = None) ->
     Returns:
         Time-compensated anomaly score
     """
-    if hour is None:
+    if hour is None or not 0 <= hour < 24:
         return anomaly_score
-    
-    # Morning window: 6-9 AM (voices may be lower/deeper)
-    # Evening window: 6-9 PM (voices may be tired)
-    # Reduce anomaly by 5-10% during these windows
-    
-    if 6 <= hour <= 9:  # Morning
-        reduction = anomaly_score * 0.08  # 8% reduction
-        compensated = anomaly_score - reduction
-        logger.debug(f"Morning compensation: hour={hour}, score={anomaly_score:.4f} -> {compensated:.4f}")
-        return max(0.0, compensated)
-    
-    if 18 <= hour <= 21:  # Evening
-        reduction = anomaly_score * 0.06  # 6% reduction
-        compensated = anomaly_score - reduction
-        logger.debug(f"Evening compensation: hour={hour}, score={anomaly_score:.4f} -> {compensated:.4f}")
-        return max(0.0, compensated)
-    
-    return anomaly_score
+
+    # Single LUT lookup replaces the morning/evening window branches
+    return max(0.0, anomaly_score * float(_HOUR_FACTOR[hour]))
 
 
 def average_embeddings(embeddings: List[np.ndarray]) -> np.ndarray: